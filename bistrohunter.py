@@ -1,68 +1,287 @@
 # IMPORTS
 import os
-from typing import Optional, List
-from fastapi import FastAPI, Query, HTTPException, Request
-from datetime import datetime
-import requests
+from typing import Optional
+from fastapi import HTTPException
+import asyncio
+import heapq
+import time
+import threading
+import httpx
 import logging
-from functools import wraps
-from math import radians, cos, sin, asin, sqrt
-
-# Desplegar fast api (no tocar)
-app = FastAPI()
+import queue
+import orjson
+from functools import wraps, lru_cache
+from logging.handlers import QueueHandler, QueueListener
+from collections import deque
+from cachetools import TTLCache
+import redis.asyncio as redis
+from utils import distancias_desde, calcular_bounding_box
 
 # Configuración del logging (nos va a decir dónde están los fallos)
 logging.basicConfig(level=logging.INFO)
+# httpx y httpcore registran cada petición en INFO con la URL completa, que lleva la clave de Google Maps y la
+# fórmula de Airtable: solo queremos sus avisos
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("httpcore").setLevel(logging.WARNING)
+
+# Mientras la app está arrancada (ver iniciar_logs) las peticiones solo encolan los registros y un hilo aparte
+# los escribe con los handlers reales, así el lock y la escritura en stdout no bloquean el event loop
+log_listener: Optional[QueueListener] = None
 
 # Secretos. Esto son urls, claves, tokens y demás que no deben mostrarse públicamente ni subirse a ningún sitio
 BASE_ID = os.getenv('BASE_ID')
 AIRTABLE_PAT = os.getenv('AIRTABLE_PAT')
 GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
 N8N_WEBHOOK_URL = os.getenv('N8N_WEBHOOK_URL')
+REDIS_URL = os.getenv('REDIS_URL')
+
+# Columna de 'Restaurantes DB' con los días de apertura. El filtro por día solo se aplica si está definida:
+# si el nombre no coincide con el de la tabla, todas las búsquedas con fecha saldrían vacías
+CAMPO_DIAS_APERTURA = os.getenv('AIRTABLE_CAMPO_DIAS_APERTURA')
+
+# URLs fijas de las APIs externas (se construyen una vez al arrancar)
+AIRTABLE_BASE_URL = f"https://api.airtable.com/v0/{BASE_ID}"
+URL_RESTAURANTES = f"{AIRTABLE_BASE_URL}/Restaurantes%20DB"
+URL_GEOCODIFICACION = "https://maps.googleapis.com/maps/api/geocode/json"
+
+# Columnas de 'Restaurantes DB' que usamos en las respuestas; pedimos solo estas a Airtable para no traer la fila entera
+CAMPOS_RESTAURANTE = [
+    "title",
+    "bh_message",
+    "price_range",
+    "url",
+    "NBH2",
+    "score",
+    "location/lat",
+    "location/lng",
+    "tripadvisor_dietary_restrictions",
+    "cid"
+]
+
+# Máximo de restaurantes por consulta. Airtable ya devuelve los mejores ordenados por NBH2 y recortados a este número,
+# así que no hace falta ordenar ni recortar por puntuación en Python
+MAX_RESTAURANTES = 10
+PARAMS_RESTAURANTES = {
+    "sort[0][field]": "NBH2",
+    "sort[0][direction]": "desc",
+    "maxRecords": MAX_RESTAURANTES,
+    "fields[]": CAMPOS_RESTAURANTE
+}
+
+# Parte geográfica de la fórmula, rellenada con (lat_min, lat_max, lon_min, lon_max)
+FORMULA_BOUNDING_BOX = (
+    "{location/lat} >= %.6f, {location/lat} <= %.6f, "
+    "{location/lng} >= %.6f, {location/lng} <= %.6f"
+)
+
+# Clientes HTTP asíncronos compartidos: reutilizan conexiones (keep-alive) sin bloquear el event loop.
+# Se crean al arrancar la app (abrir_clientes) y se cierran al apagarla (cerrar_clientes)
+airtable_client: Optional[httpx.AsyncClient] = None
+http_client: Optional[httpx.AsyncClient] = None
+
+# Airtable admite 5 peticiones por segundo por base y penaliza con 30 s si se supera.
+# El límite es de la base, no del proceso: con varios workers (WEB_CONCURRENCY) cada uno se queda con su parte,
+# PETICIONES_POR_VENTANA peticiones cada VENTANA_AIRTABLE segundos, para que entre todos no pasen de 5 por segundo.
+# Guardamos cuándo salieron las últimas peticiones de la ventana para no pasarnos
+AIRTABLE_PETICIONES_POR_SEGUNDO = 5
+NUM_WORKERS = max(1, int(os.getenv('WEB_CONCURRENCY', '1')))
+PETICIONES_POR_VENTANA = max(1, AIRTABLE_PETICIONES_POR_SEGUNDO // NUM_WORKERS)
+VENTANA_AIRTABLE = PETICIONES_POR_VENTANA * NUM_WORKERS / AIRTABLE_PETICIONES_POR_SEGUNDO
+peticiones_airtable = deque(maxlen=PETICIONES_POR_VENTANA)
+airtable_lock = asyncio.Lock()
+
+async def esperar_turno_airtable():
+    async with airtable_lock:
+        ahora = time.monotonic()
+        while peticiones_airtable and ahora - peticiones_airtable[0] >= VENTANA_AIRTABLE:
+            peticiones_airtable.popleft()
+        if len(peticiones_airtable) == PETICIONES_POR_VENTANA:
+            await asyncio.sleep(VENTANA_AIRTABLE - (ahora - peticiones_airtable[0]))
+        peticiones_airtable.append(time.monotonic())
+
+# Caché en dos niveles: TTLCache en memoria (por worker) y Redis compartido entre workers (opcional, si hay REDIS_URL).
+# Cada tipo de dato tiene su propia caché con su TTL:
+# - restaurantes_cache: consultas a 'Restaurantes DB'. Pasada 1 h la entrada se sigue sirviendo, pero se refresca
+#   en segundo plano; a las 4 h desaparece del todo
+# - coordenadas_cache: geocodificación de zonas con Google Maps, que prácticamente no cambia (24 h)
+# - busquedas_cache: resultado final de cada búsqueda (ciudad + filtros + zona/coordenadas), 5 min
+# Cada entrada se guarda como (resultado, momento_en_que_se_guardó)
+RESTAURANTES_TTL_FRESCO = 60*60
+restaurantes_cache = TTLCache(maxsize=10000, ttl=RESTAURANTES_TTL_FRESCO * 4)
+coordenadas_cache = TTLCache(maxsize=2048, ttl=60*60*24)
+busquedas_cache = TTLCache(maxsize=1000, ttl=60*5)
+redis_client: Optional[redis.Redis] = None
+# Segundos como máximo para conectar con Redis o esperar su respuesta: si Redis no responde, pasamos a Airtable
+# en vez de bloquear la petición hasta el timeout de TCP
+REDIS_TIMEOUT = 0.2
+cache_lock = threading.RLock()
+SIN_VALOR = object()
+
+# Claves que se están refrescando ahora mismo y referencias a sus tareas (para que no las borre el recolector de basura)
+claves_refrescando = set()
+tareas_en_segundo_plano = set()
+
+# Crea los clientes HTTP y Redis al arrancar la app. El de Airtable lleva el token ya puesto; el otro
+# (Google Maps) no debe enviarlo. Si ya están abiertos no hace nada
+def abrir_clientes():
+    global airtable_client, http_client, redis_client, airtable_lock
+    if airtable_client is None:
+        airtable_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=40),
+            headers={"Authorization": f"Bearer {AIRTABLE_PAT}"},
+            timeout=5
+        )
+    if http_client is None:
+        http_client = httpx.AsyncClient(timeout=10)
+    if redis_client is None and REDIS_URL:
+        redis_client = redis.Redis.from_url(
+            REDIS_URL, socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT
+        )
+    # El lock queda ligado al event loop en el que se usa; uno nuevo por arranque
+    airtable_lock = asyncio.Lock()
+
+# Cierra los clientes HTTP y Redis al apagar la app, después de que terminen los refrescos y escrituras en Redis
+# pendientes. Se puede llamar más de una vez
+async def cerrar_clientes():
+    global airtable_client, http_client, redis_client
+    if tareas_en_segundo_plano:
+        await asyncio.gather(*tareas_en_segundo_plano, return_exceptions=True)
+    if airtable_client is not None:
+        await airtable_client.aclose()
+        airtable_client = None
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+    if redis_client is not None:
+        await redis_client.aclose()
+        redis_client = None
+
+# Pasa los handlers del logger raíz a un hilo aparte: el logger raíz solo encola en una cola en memoria
+def iniciar_logs():
+    global log_listener
+    if log_listener is not None:
+        return
+    logger_raiz = logging.getLogger()
+    cola_logs = queue.SimpleQueue()
+    log_listener = QueueListener(cola_logs, *logger_raiz.handlers, respect_handler_level=True)
+    logger_raiz.handlers = [QueueHandler(cola_logs)]
+    log_listener.start()
+
+# Devuelve los handlers originales al logger raíz, vacía la cola pendiente y para el hilo.
+# Se puede llamar más de una vez; después los registros se siguen escribiendo directamente
+def cerrar_logs():
+    global log_listener
+    if log_listener is None:
+        return
+    logging.getLogger().handlers = list(log_listener.handlers)
+    log_listener.stop()
+    log_listener = None
+
+# Convierte dicts y listas en tuplas ordenadas para poder usarlos como clave de la caché
+def congelar(valor):
+    if isinstance(valor, dict):
+        return tuple(sorted((k, congelar(v)) for k, v in valor.items()))
+    if isinstance(valor, (list, tuple)):
+        return tuple(congelar(v) for v in valor)
+    return valor
+
+def numero_de_registros(resultado) -> int:
+    return len(resultado.get('records', [])) if isinstance(resultado, dict) else 0
+
+# Lanza la corrutina como tarea aparte, guardando la referencia hasta que termine
+def en_segundo_plano(corrutina):
+    tarea = asyncio.create_task(corrutina)
+    tareas_en_segundo_plano.add(tarea)
+    tarea.add_done_callback(tareas_en_segundo_plano.discard)
+
+async def escribir_en_redis(cliente: redis.Redis, redis_key: str, ttl: int, valor: bytes):
+    try:
+        await cliente.setex(redis_key, ttl, valor)
+    except Exception as e:
+        logging.error("Error al escribir en Redis: %s", e)
+
+# Clave en Redis de una clave de la caché en memoria. Solo se construye cuando se usa Redis (el repr no es barato)
+def clave_redis(cache_key: tuple) -> str:
+    return repr(cache_key)
+
+# Guarda la entrada en memoria y, si hay Redis, la escribe allí en segundo plano (la petición no espera a Redis)
+def guardar_en_cache(cache, cache_key, entrada):
+    with cache_lock:
+        cache[cache_key] = entrada
+    if redis_client:
+        en_segundo_plano(
+            escribir_en_redis(redis_client, clave_redis(cache_key), int(cache.ttl), orjson.dumps(entrada))
+        )
 
-# Calcula la distancia haversiana entre dos puntos (filtro de zona)
-def haversine(lon1, lat1, lon2, lat2):
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-    c = 2 * asin(sqrt(a))
-    km = 6367 * c
-    return km
-
-
-def calcular_bounding_box(lat, lon, radio_km=1):
-    # Aproximación: 1 grado de latitud ~ 111.32 km
-    km_por_grado_lat = 111.32
-    delta_lat = radio_km / km_por_grado_lat
-
-    # Para la longitud, depende de la latitud
-    cos_lat = cos(radians(lat))
-    km_por_grado_lon = 111.32 * cos_lat
-    delta_lon = radio_km / km_por_grado_lon
-
-    lat_min = lat - delta_lat
-    lat_max = lat + delta_lat
-    lon_min = lon - delta_lon
-    lon_max = lon + delta_lon
-
-    return {
-        "lat_min": lat_min,
-        "lat_max": lat_max,
-        "lon_min": lon_min,
-        "lon_max": lon_max
-    }
+# Vuelve a pedir el dato caducado y solo lo sustituye si la respuesta nueva no trae menos registros que la guardada
+# (así una respuesta parcial o fallida de Airtable no pisa una lista buena). Si se descarta, el dato anterior se
+# vuelve a guardar con la hora actual: si no, cada acierto siguiente lanzaría otro refresco contra Airtable
+async def refrescar_cache(func, cache, cache_key, anterior, args, kwargs):
+    nuevo = anterior
+    try:
+        result = await func(*args, **kwargs)
+        if result is not None and numero_de_registros(result) >= numero_de_registros(anterior):
+            nuevo = result
+    except Exception as e:
+        logging.error("Error al refrescar la caché: %s", e)
+    try:
+        guardar_en_cache(cache, cache_key, (nuevo, time.time()))
+    finally:
+        claves_refrescando.discard(cache_key)
+
+# Decorador de caché. Con ttl_fresco, las entradas más antiguas que eso se devuelven igualmente pero se refrescan en
+# segundo plano; sin él, simplemente caducan con el TTL de la caché
+def cache_airtable_request(cache: TTLCache, ttl_fresco: Optional[float] = None):
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            cache_key = (func.__name__, congelar(args), congelar(kwargs))
+            with cache_lock:
+                entrada = cache.get(cache_key, SIN_VALOR)
+
+            if entrada is SIN_VALOR and redis_client:
+                try:
+                    cached = await redis_client.get(clave_redis(cache_key))
+                    if cached is not None:
+                        entrada = tuple(orjson.loads(cached))
+                        with cache_lock:
+                            cache[cache_key] = entrada
+                except Exception as e:
+                    logging.error("Error al leer de Redis: %s", e)
+
+            if entrada is not SIN_VALOR:
+                result, guardado_en = entrada
+                # Dato caducado: lo devolvemos igualmente y lo refrescamos en segundo plano
+                if ttl_fresco and time.time() - guardado_en > ttl_fresco and cache_key not in claves_refrescando:
+                    claves_refrescando.add(cache_key)
+                    en_segundo_plano(refrescar_cache(func, cache, cache_key, result, args, kwargs))
+                return result
+
+            result = await func(*args, **kwargs)
+            if result is None:
+                # No guardamos las respuestas fallidas
+                return result
+
+            guardar_en_cache(cache, cache_key, (result, time.time()))
+            return result
+        return wrapper
+    return decorator
+
+# Respuesta de obtener_coordenadas_zona cuando Google no conoce la zona. Es una respuesta válida y se cachea como
+# las demás (None, en cambio, es un fallo de la llamada y no se cachea)
+ZONA_NO_ENCONTRADA = {}
 
 # Función que obtiene las coordenadas de la zona que ha especificado el cliente
-def obtener_coordenadas_zona(zona: str, ciudad: str, radio_km: float) -> Optional[dict]:
+@cache_airtable_request(coordenadas_cache)
+async def obtener_coordenadas_zona(zona: str, ciudad: str, radio_km: float) -> Optional[dict]:
     try:
-        url = f"https://maps.googleapis.com/maps/api/geocode/json"
         params = {
             "address": f"{zona}, {ciudad}",
             "key": GOOGLE_MAPS_API_KEY,
             "components": "country:ES"
         }
-        response = requests.get(url, params=params)
+        response = await http_client.get(URL_GEOCODIFICACION, params=params)
         data = response.json()
         if data['status'] == 'OK':
             geometry = data['results'][0]['geometry']
@@ -74,20 +293,123 @@ def obtener_coordenadas_zona(zona: str, ciudad: str, radio_km: float) -> Optiona
                 "location": location,
                 "bounding_box": bounding_box
             }
+        elif data['status'] == 'ZERO_RESULTS':
+            return ZONA_NO_ENCONTRADA
         else:
-            logging.error(f"Error en la geocodificación: {data['status']}")
+            logging.error("Error en la geocodificación: %s", data['status'])
             return None
     except Exception as e:
-        logging.error(f"Error al obtener coordenadas de la zona: {e}")
+        logging.error("Error al obtener coordenadas de la zona: %s", e)
         return None
 
-def airtable_request(url, headers, params, view_id: Optional[str] = None):
+# Pasa el texto a minúsculas y sin espacios sobrantes. Un texto vacío cuenta como filtro no indicado (None)
+def normalizar_texto(texto: Optional[str]) -> Optional[str]:
+    return texto.strip().lower() or None if texto else None
+
+# Escapa barras y comillas simples para poder meter texto del usuario dentro de una fórmula de Airtable (p.e. L'Hospitalet)
+def escapar_formula(texto: str) -> str:
+    return texto.replace("\\", "\\\\").replace("'", "\\'")
+
+# Intentos por petición cuando Airtable responde 429
+INTENTOS_AIRTABLE = 3
+
+# Segundos de espera que pide la cabecera Retry-After. Si no viene, o viene como fecha HTTP en vez de segundos,
+# usamos el backoff por defecto
+def segundos_retry_after(valor: Optional[str], por_defecto: float) -> float:
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return por_defecto
+
+@cache_airtable_request(restaurantes_cache, ttl_fresco=RESTAURANTES_TTL_FRESCO)
+async def airtable_request(url, params, view_id: Optional[str] = None):
     if view_id:
         params["view"] = view_id
-    response = requests.get(url, headers=headers, params=params)
-    return response.json() if response.status_code == 200 else None
+    for intento in range(INTENTOS_AIRTABLE):
+        await esperar_turno_airtable()
+        response = await airtable_client.get(url, params=params)
+        if response.status_code != 429:
+            break
+        if intento == INTENTOS_AIRTABLE - 1:
+            # Último intento: no tiene sentido esperar para acabar devolviendo None igualmente
+            logging.error("Airtable sigue limitando la petición (429) tras %s intentos", INTENTOS_AIRTABLE)
+            break
+        # Si aun así nos limitan, esperamos lo que pida Airtable (o un backoff corto) y reintentamos
+        espera = segundos_retry_after(response.headers.get("Retry-After"), 2 ** intento)
+        logging.error("Airtable ha limitado la petición (429), reintentando en %s s", espera)
+        await asyncio.sleep(espera)
+    return orjson.loads(response.content) if response.is_success else None
+
+# Construye los filtros base de la fórmula (dia_semana, price_range, cocina, diet, dish).
+# Las entradas ya llegan normalizadas, así que consultas equivalentes reutilizan el resultado cacheado
+@lru_cache(maxsize=4096)
+def construir_filtros_base(
+    dia_semana: Optional[str],
+    price_range: Optional[str],
+    cocina: Optional[str],
+    diet: Optional[str],
+    dish: Optional[str]
+) -> tuple:
+    base_filters = []
+
+    # --- dia_semana ---
+    # Se filtra en la misma consulta, así no hace falta una petición por restaurante para ver si abre ese día
+    if dia_semana and CAMPO_DIAS_APERTURA:
+        base_filters.append(
+            f"FIND('{escapar_formula(dia_semana)}', ARRAYJOIN({{{CAMPO_DIAS_APERTURA}}}, ', ')) > 0"
+        )
 
-def obtener_restaurantes_por_ciudad(
+    # --- price_range ---
+    if price_range:
+        ranges = price_range.split(',')
+        if len(ranges) == 1:
+            # Caso de un solo rango, p.e. '$$'
+            base_filters.append(
+                f"FIND('{escapar_formula(price_range)}', ARRAYJOIN({{price_range}}, ', ')) > 0"
+            )
+        else:
+            # Caso de varios rangos, p.e. '$, $$'
+            conditions = [
+                f"FIND('{escapar_formula(r.strip())}', ARRAYJOIN({{price_range}}, ', ')) > 0"
+                for r in ranges
+            ]
+            base_filters.append(f"OR({', '.join(conditions)})")
+
+    # --- cocina ---
+    if cocina:
+        cocinas = cocina.split(',')
+        if len(cocinas) == 1:
+            base_filters.append(
+                f"SEARCH('{escapar_formula(cocina)}', LOWER({{categories_string}})) > 0"
+            )
+        else:
+            conditions = [
+                f"SEARCH('{escapar_formula(c.strip())}', LOWER({{categories_string}})) > 0"
+                for c in cocinas
+            ]
+            base_filters.append(f"OR({', '.join(conditions)})")
+
+    # --- diet ---
+    if diet:
+        base_filters.append(f"SEARCH('{escapar_formula(diet)}', LOWER({{categories_string}})) > 0")
+
+    # --- dish ---
+    if dish:
+        dishes = dish.split(',')
+        if len(dishes) == 1:
+            base_filters.append(
+                f"SEARCH('{escapar_formula(dish)}', LOWER({{google_reviews}})) > 0"
+            )
+        else:
+            conditions = [
+                f"SEARCH('{escapar_formula(d.strip())}', LOWER({{google_reviews}})) > 0"
+                for d in dishes
+            ]
+            base_filters.append(f"OR({', '.join(conditions)})")
+
+    return tuple(base_filters)
+
+async def obtener_restaurantes_por_ciudad(
     city: str,
     dia_semana: Optional[str] = None,
     price_range: Optional[str] = None,
@@ -95,70 +417,110 @@ def obtener_restaurantes_por_ciudad(
     diet: Optional[str] = None,
     dish: Optional[str] = None,
     zona: Optional[str] = None,
-    coordenadas: Optional[list] = None,
+    coordenadas: Optional[str] = None,
     radio_km: float = 1.0,
     sort_by_proximity: bool = True
 ) -> (list[dict], Optional[str]):
-    try:
-        table_name = 'Restaurantes DB'
-        url = f"https://api.airtable.com/v0/{BASE_ID}/{table_name}"
-        headers = {
-            "Authorization": f"Bearer {AIRTABLE_PAT}",
-        }
+    # Normalizamos las entradas: 'Madrid', 'madrid' y ' Madrid ' dan la misma fórmula y la misma clave de caché
+    city = normalizar_texto(city)
+    cocina = normalizar_texto(cocina)
+    diet = normalizar_texto(diet)
+    dish = normalizar_texto(dish)
+    zona = normalizar_texto(zona)
+    price_range = price_range.strip() or None if price_range else None
+    coordenadas = coordenadas.replace(" ", "") or None if coordenadas else None
+    if not CAMPO_DIAS_APERTURA:
+        # Sin columna de días el día no filtra nada: que no separe en la caché búsquedas que son iguales
+        dia_semana = None
 
-        # 1) Construimos los filtros base (price_range, cocina, diet, dish)
-        base_filters = []
+    # Sin ciudad no hay nada que buscar: evitamos la llamada a Google/Airtable
+    if not city:
+        return [], None
 
-        # --- price_range ---
-        if price_range:
-            ranges = price_range.split(',')
-            if len(ranges) == 1:
-                # Caso de un solo rango, p.e. '$$'
-                base_filters.append(
-                    f"FIND('{price_range.strip()}', ARRAYJOIN({{price_range}}, ', ')) > 0"
-                )
-            else:
-                # Caso de varios rangos, p.e. '$, $$'
-                conditions = [
-                    f"FIND('{r.strip()}', ARRAYJOIN({{price_range}}, ', ')) > 0"
-                    for r in ranges
-                ]
-                base_filters.append(f"OR({', '.join(conditions)})")
-
-        # --- cocina ---
-        if cocina:
-            cocinas = cocina.split(',')
-            if len(cocinas) == 1:
-                base_filters.append(
-                    f"SEARCH('{cocina.strip()}', {{categories_string}}) > 0"
-                )
-            else:
-                conditions = [
-                    f"SEARCH('{c.strip()}', {{categories_string}}) > 0"
-                    for c in cocinas
-                ]
-                base_filters.append(f"OR({', '.join(conditions)})")
-
-        # --- diet ---
-        if diet:
-            base_filters.append(f"SEARCH('{diet.strip()}', {{categories_string}}) > 0")
-
-        # --- dish ---
-        if dish:
-            dishes = dish.split(',')
-            if len(dishes) == 1:
-                base_filters.append(
-                    f"SEARCH('{dish.strip()}', {{google_reviews}}) > 0"
-                )
-            else:
-                conditions = [
-                    f"SEARCH('{d.strip()}', {{google_reviews}}) > 0"
-                    for d in dishes
-                ]
-                base_filters.append(f"OR({', '.join(conditions)})")
+    try:
+        return await buscar_restaurantes(
+            city=city,
+            dia_semana=dia_semana,
+            price_range=price_range,
+            cocina=cocina,
+            diet=diet,
+            dish=dish,
+            zona=zona,
+            coordenadas=coordenadas,
+            radio_km=radio_km,
+            sort_by_proximity=sort_by_proximity
+        )
+    except BusquedaIncompleta as e:
+        # Devolvemos lo que se haya encontrado; la siguiente búsqueda igual volverá a preguntar a Google/Airtable
+        return e.resultado
+
+# Añade a los filtros base la parte geográfica (la bounding box) y hace un AND global de todas las partes
+def formula_con_bounding_box(base_filters: tuple, bounding_box: dict) -> str:
+    geo_filter = FORMULA_BOUNDING_BOX % (
+        bounding_box['lat_min'], bounding_box['lat_max'],
+        bounding_box['lon_min'], bounding_box['lon_max']
+    )
+    return f"AND({', '.join(base_filters + (geo_filter,))})"
+
+# Geocodifica una zona y trae de Airtable los restaurantes dentro de su bounding box.
+# Devuelve (fórmula, registros); (None, []) si Google no conoce la zona, y None si ha fallado la llamada a
+# Google o a Airtable
+async def buscar_en_zona(zona_item: str, city: str, radio_km: float, base_filters: tuple) -> Optional[tuple]:
+    location_zona = await obtener_coordenadas_zona(zona_item, city, radio_km)
+    if location_zona is None:
+        logging.error("No se pudo geocodificar la zona '%s'", zona_item)
+        return None
+    if not location_zona:
+        logging.error("Zona '%s' no encontrada.", zona_item)
+        return None, []
+
+    filter_formula = formula_con_bounding_box(base_filters, location_zona['bounding_box'])
+    logging.debug(
+        "Fórmula de filtro construida para zona '%s': %s", zona_item, filter_formula
+    )
+
+    params = {
+        "filterByFormula": filter_formula,
+        **PARAMS_RESTAURANTES
+    }
+
+    response_data = await airtable_request(URL_RESTAURANTES, params, view_id="viw6z7g5ZZs3mpy3S")
+    if not response_data or 'records' not in response_data:
+        logging.error("Airtable no devolvió resultados válidos para la zona '%s'", zona_item)
+        return None
+    return filter_formula, response_data['records']
+
+# Búsqueda en la que ha fallado alguna llamada a Google o Airtable. Lleva lo que sí se encontró para poder
+# devolverlo igualmente, pero al salir como excepción la caché de búsquedas no lo guarda
+class BusquedaIncompleta(Exception):
+    def __init__(self, resultado: tuple):
+        super().__init__("Búsqueda incompleta")
+        self.resultado = resultado
+
+# Búsqueda completa (geocodificación + consultas a Airtable) con las entradas ya normalizadas.
+# Se cachea entera durante unos minutos, así las búsquedas repetidas no vuelven a recorrer zonas y radios.
+# Si falla alguna llamada lanza BusquedaIncompleta, para no cachear como vacío lo que fue un error
+@cache_airtable_request(busquedas_cache)
+async def buscar_restaurantes(
+    city: str,
+    dia_semana: Optional[str],
+    price_range: Optional[str],
+    cocina: Optional[str],
+    diet: Optional[str],
+    dish: Optional[str],
+    zona: Optional[str],
+    coordenadas: Optional[str],
+    radio_km: float,
+    sort_by_proximity: bool
+) -> (list[dict], Optional[str]):
+    try:
+        # 1) Construimos los filtros base (dia_semana, price_range, cocina, diet, dish)
+        base_filters = construir_filtros_base(dia_semana, price_range, cocina, diet, dish)
 
         restaurantes_encontrados = []
+        ids_vistos = set()
         final_filter_formula = None  # para retornarla después si quieres verla
+        busqueda_completa = True
 
         # 2) Si hay ZONA
         if zona:
@@ -168,50 +530,28 @@ def obtener_restaurantes_por_ciudad(
                 [zona]
             )
 
-            for zona_item in zonas_list:
-                location_zona = obtener_coordenadas_zona(zona_item, city, radio_km)
-                if not location_zona:
-                    logging.error(f"Zona '{zona_item}' no encontrada.")
-                    continue
-
-                location = location_zona['location']
-                bounding_box = location_zona['bounding_box']
-                lat_min = bounding_box['lat_min']
-                lat_max = bounding_box['lat_max']
-                lon_min = bounding_box['lon_min']
-                lon_max = bounding_box['lon_max']
-
-                # Creamos una copia de los filtros base y le añadimos la parte geográfica
-                zone_filters = base_filters.copy()
-                zone_filters.append(f"{{location/lat}} >= {lat_min}")
-                zone_filters.append(f"{{location/lat}} <= {lat_max}")
-                zone_filters.append(f"{{location/lng}} >= {lon_min}")
-                zone_filters.append(f"{{location/lng}} <= {lon_max}")
-
-                # Hacemos un AND global de todas las partes
-                final_filter_formula = f"AND({', '.join(zone_filters)})"
-                logging.info(
-                    f"Fórmula de filtro construida para zona '{zona_item}': {final_filter_formula}"
-                )
-
-                params = {
-                    "filterByFormula": final_filter_formula,
-                    "sort[0][field]": "NBH2",
-                    "sort[0][direction]": "desc",
-                    "maxRecords": 10
-                }
+            # Las zonas son independientes: geocodificamos y consultamos Airtable para todas a la vez.
+            # gather mantiene el orden de zonas_list, así el resultado es el mismo que en secuencia
+            resultados_zonas = await asyncio.gather(*(
+                buscar_en_zona(zona_item, city, radio_km, base_filters)
+                for zona_item in zonas_list
+            ))
 
-                response_data = airtable_request(url, headers, params, view_id="viw6z7g5ZZs3mpy3S")
-                if response_data and 'records' in response_data:
-                    # Evitamos duplicados
-                    nuevos_restaurantes = [
-                        r for r in response_data['records']
-                        if r not in restaurantes_encontrados
-                    ]
-                    restaurantes_encontrados.extend(nuevos_restaurantes)
+            for resultado_zona in resultados_zonas:
+                if resultado_zona is None:
+                    busqueda_completa = False
+                    continue
+                filter_formula, registros = resultado_zona
+                if filter_formula is not None:
+                    final_filter_formula = filter_formula
+                # Evitamos duplicados
+                for r in registros:
+                    if r['id'] not in ids_vistos:
+                        ids_vistos.add(r['id'])
+                        restaurantes_encontrados.append(r)
 
             # Ajustamos la cantidad máximo de restaurantes
-            max_total_restaurantes = len(zonas_list) * 10
+            max_total_restaurantes = len(zonas_list) * MAX_RESTAURANTES
             restaurantes_encontrados = restaurantes_encontrados[:max_total_restaurantes]
 
         # 3) Si NO hay ZONA, utilizamos coordenadas (y un radio incremental)
@@ -222,55 +562,42 @@ def obtener_restaurantes_por_ciudad(
                     detail="Debes especificar 'zona' o 'coordenadas'."
                 )
 
-            logging.info(f"Coordenadas recibidas: {coordenadas}")
-            coords = [float(coord) for coord in coordenadas.split(",")]
-            if len(coords) != 2:
+            try:
+                lat_centro, lon_centro = map(float, coordenadas.split(",", 1))
+            except ValueError:
                 raise HTTPException(
                     status_code=400,
                     detail="Coordenadas inválidas. Deben ser [lat, lng] en texto."
                 )
 
-            lat_centro, lon_centro = coords
-            logging.info(f"Coordenadas procesadas: lat={lat_centro}, lon={lon_centro}")
-
-            # Mientras no tengamos al menos 10 resultados, agrandamos el radio
-            while len(restaurantes_encontrados) < 10:
+            # Mientras no tengamos al menos MAX_RESTAURANTES resultados, agrandamos el radio
+            while len(restaurantes_encontrados) < MAX_RESTAURANTES:
                 bounding_box = calcular_bounding_box(lat_centro, lon_centro, radio_km)
-                lat_min = bounding_box['lat_min']
-                lat_max = bounding_box['lat_max']
-                lon_min = bounding_box['lon_min']
-                lon_max = bounding_box['lon_max']
-
-                # Copiamos los filtros base y añadimos la parte geográfica
-                geo_filters = base_filters.copy()
-                geo_filters.extend([
-                    f"{{location/lat}} >= {lat_min}",
-                    f"{{location/lat}} <= {lat_max}",
-                    f"{{location/lng}} >= {lon_min}",
-                    f"{{location/lng}} <= {lon_max}"
-                ])
-
-                final_filter_formula = f"AND({', '.join(geo_filters)})"
-                logging.info(
-                    f"Fórmula de filtro construida: location=({lat_centro}, {lon_centro}), bounding_box={final_filter_formula}"
+
+                final_filter_formula = formula_con_bounding_box(base_filters, bounding_box)
+                logging.debug(
+                    "Fórmula de filtro construida: location=(%s, %s), bounding_box=%s",
+                    lat_centro, lon_centro, final_filter_formula
                 )
 
                 params = {
                     "filterByFormula": final_filter_formula,
-                    "sort[0][field]": "NBH2",
-                    "sort[0][direction]": "desc",
-                    "maxRecords": 10
+                    **PARAMS_RESTAURANTES
                 }
 
-                response_data = airtable_request(url, headers, params)
-                if response_data and 'records' in response_data:
-                    nuevos_restaurantes = [
-                        r for r in response_data['records']
-                        if r not in restaurantes_encontrados
-                    ]
-                    restaurantes_encontrados.extend(nuevos_restaurantes)
+                response_data = await airtable_request(URL_RESTAURANTES, params)
+                if not response_data or 'records' not in response_data:
+                    # Si Airtable falla, agrandar el radio solo repetiría la misma petición fallida
+                    logging.error("Airtable no devolvió resultados válidos para radio %s km", radio_km)
+                    busqueda_completa = False
+                    break
+
+                for r in response_data['records']:
+                    if r['id'] not in ids_vistos:
+                        ids_vistos.add(r['id'])
+                        restaurantes_encontrados.append(r)
 
-                if len(restaurantes_encontrados) >= 10:
+                if len(restaurantes_encontrados) >= MAX_RESTAURANTES:
                     break
 
                 # Incrementamos el radio para volver a intentar
@@ -280,114 +607,39 @@ def obtener_restaurantes_por_ciudad(
 
             # 4) Orden opcional por proximidad
             if sort_by_proximity and restaurantes_encontrados:
-                restaurantes_encontrados.sort(
-                    key=lambda r: haversine(
-                        lon_centro,
-                        lat_centro,
-                        float(r['fields'].get('location/lng', 0)),
-                        float(r['fields'].get('location/lat', 0))
-                    )
+                # Separamos de una pasada los restaurantes sin coordenadas (no se puede calcular su distancia y van
+                # al final) y pasamos lat/lng a float una sola vez por restaurante
+                con_coords = []
+                coords = []
+                sin_coords = []
+                for r in restaurantes_encontrados:
+                    fields = r['fields']
+                    if 'location/lat' in fields and 'location/lng' in fields:
+                        con_coords.append(r)
+                        coords.append((float(fields['location/lat']), float(fields['location/lng'])))
+                    else:
+                        sin_coords.append(r)
+
+                # Distancias en una lista paralela a con_coords.
+                # Nos quedamos con los MAX_RESTAURANTES más cercanos sin ordenar la lista entera
+                distancias = distancias_desde(lat_centro, lon_centro, coords)
+                cercanos = heapq.nsmallest(
+                    MAX_RESTAURANTES, range(len(con_coords)), key=distancias.__getitem__
                 )
+                restaurantes_encontrados = ([con_coords[i] for i in cercanos] + sin_coords)[:MAX_RESTAURANTES]
+            else:
+                # Tomamos los primeros MAX_RESTAURANTES
+                restaurantes_encontrados = restaurantes_encontrados[:MAX_RESTAURANTES]
 
-            # Tomamos los primeros 10
-            restaurantes_encontrados = restaurantes_encontrados[:10]
-
+        if not busqueda_completa:
+            raise BusquedaIncompleta((restaurantes_encontrados, final_filter_formula))
         return restaurantes_encontrados, final_filter_formula
 
+    except (HTTPException, BusquedaIncompleta):
+        raise
     except Exception as e:
-        logging.error(f"Error al obtener restaurantes de la ciudad: {e}")
+        logging.error("Error al obtener restaurantes de la ciudad: %s", e)
         raise HTTPException(
             status_code=500,
             detail="Error al obtener restaurantes de la ciudad"
         )
-
-@app.post("/procesar-variables")
-
-#Esta es la función que convierte los datos que ha extraído el agente de IA en las variables que usa la función obtener_restaurantes y luego llama a esta misma función y extrae y ofrece los resultados
-async def procesar_variables(request: Request):
-    try:
-        data = await request.json()
-        logging.info(f"Datos recibidos: {data}")
-        
-        city = data.get('city')
-        date = data.get('date')
-        price_range = data.get('price_range')
-        cocina = data.get('cocina')
-        diet = data.get('diet')
-        dish = data.get('dish')
-        zona = data.get('zona')
-        coordenadas = data.get('coordenadas')
-
-        if not city:
-            raise HTTPException(status_code=400, detail="La variable 'city' es obligatoria.")
-
-        dia_semana = None
-        if date:
-            try:
-                fecha = datetime.strptime(date, "%Y-%m-%d")
-                dia_semana = obtener_dia_semana(fecha)
-            except ValueError:
-                raise HTTPException(status_code=400, detail="La fecha proporcionada no tiene el formato correcto (YYYY-MM-DD).")
-
-        # Llama a la función obtener_restaurantes_por_ciudad y construye la filter_formula
-        restaurantes, filter_formula = obtener_restaurantes_por_ciudad(
-            city=city,
-            dia_semana=dia_semana,
-            price_range=price_range,
-            cocina=cocina,
-            diet=diet,
-            dish=dish,
-            zona=zona,
-            coordenadas=coordenadas
-        )
-
-        # Capturar la URL completa y los parámetros de la solicitud
-        full_url = str(request.url)
-        request_method = request.method
-
-        # Capturar la información del request
-        http_request_info = f'{request_method} {full_url} HTTP/1.1 200 OK'
-        
-        # Si no se encontraron restaurantes, devolver el mensaje y el request_info
-        if not restaurantes:
-            return {
-                "request_info": http_request_info,
-                "variables": {
-                    "city": city,
-                    "zone": zona,
-                    "cuisine_type": cocina,
-                    "price_range": price_range,
-                    "date": date,
-                    "alimentary_restrictions": diet,
-                    "specific_dishes": dish
-                },
-                "mensaje": "No se encontraron restaurantes con los filtros aplicados."
-            }
-        
-        # Procesar los restaurantes
-        resultados = [
-            {
-                "bh_message": restaurante['fields'].get('bh_message', 'Sin descripción'),
-                "url": restaurante['fields'].get('url', 'No especificado')
-            }
-            for restaurante in restaurantes
-        ]
-        
-        # Devolver los resultados junto con el log de la petición HTTP
-        return {
-            "request_info": http_request_info,
-            "variables": {
-                "city": city,
-                "zone": zona,
-                "cuisine_type": cocina,
-                "price_range": price_range,
-                "date": date,
-                "alimentary_restrictions": diet,
-                "specific_dishes": dish
-            },
-            "resultados": resultados
-        }
-    
-    except Exception as e:
-        logging.error(f"Error al procesar variables: {e}")
-        return {"error": "Ocurrió un error al procesar las variables"}
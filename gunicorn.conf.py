@@ -0,0 +1,19 @@
+# Configuración de gunicorn para servir la app con varios procesos: gunicorn -c gunicorn.conf.py main:app
+# Cada worker es un proceso con su propio event loop de uvicorn (uvloop + httptools si están instalados)
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn_worker.UvicornWorker"
+
+# Pocos workers por defecto: Airtable limita a 5 peticiones por segundo por base, sumando todos los workers, y
+# cpu_count() en Render devuelve las CPUs de la máquina, no las del contenedor. Se cambia con WEB_CONCURRENCY
+# (no con -w), porque cada worker lo lee para quedarse con su parte del límite de Airtable.
+# Con más de un worker conviene definir REDIS_URL para que compartan la caché de Airtable
+workers = max(1, int(os.getenv("WEB_CONCURRENCY", "2")))
+raw_env = [f"WEB_CONCURRENCY={workers}"]
+
+# Sin preload_app: cada worker importa la app por su cuenta y crea sus propios clientes HTTP e hilo de logs,
+# que no sobrevivirían a un fork
+preload_app = False
+timeout = 30
+graceful_timeout = 30
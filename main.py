@@ -1,103 +1,224 @@
 # IMPORTS
-from fastapi import FastAPI, Query, HTTPException, Request
+from fastapi import FastAPI, Query, Body, HTTPException, Request
+from fastapi.responses import Response
+from pydantic import BaseModel, Field
 from typing import Optional
+from contextlib import asynccontextmanager
+import asyncio
 import logging
-from datetime import datetime
+import operator
+import orjson
 from bistrohunter import (
     obtener_restaurantes_por_ciudad,
-    calcular_bounding_box,  
-    obtener_coordenadas_zona,
-    haversine,
+    abrir_clientes,
+    cerrar_clientes,
+    iniciar_logs,
+    cerrar_logs,
 )
+from utils import dia_semana_desde_texto
 
-app = FastAPI()
+# Al arrancar la app abrimos los clientes de Airtable, Google Maps y Redis, creamos el semáforo del batch y pasamos
+# los logs a su hilo; al apagarla cerramos las conexiones y vaciamos los logs
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global semaforo_batch
+    iniciar_logs()
+    abrir_clientes()
+    semaforo_batch = asyncio.Semaphore(MAX_BUSQUEDAS_SIMULTANEAS)
+    try:
+        yield
+    finally:
+        await cerrar_clientes()
+        cerrar_logs()
+
+# Los endpoints declaran su tipo de retorno (-> dict): así FastAPI serializa la respuesta directamente a JSON con
+# Pydantic, sin pasar por jsonable_encoder ni necesitar una clase de respuesta propia
+app = FastAPI(lifespan=lifespan)
+
+# La respuesta de la raíz es fija (también la usan los health checks): la serializamos una sola vez
+RESPUESTA_RAIZ = orjson.dumps({"message": "Bienvenido a la API de búsqueda de restaurantes"})
 
 @app.get("/")
 async def root():
-    return {"message": "Bienvenido a la API de búsqueda de restaurantes"}
+    return Response(content=RESPUESTA_RAIZ, media_type="application/json")
+
+# Convierte un registro de Airtable en el restaurante que devuelve /api/getRestaurants.
+# Los campos que faltan en Airtable no vienen en el registro, por eso se usa .get con valor por defecto
+def formatear_restaurante(r: dict) -> dict:
+    fields = r["fields"]
+    return {
+        "cid": fields.get("cid"),
+        "title": fields.get("title", "Sin título"),
+        "description": fields.get("bh_message", "Sin descripción"),
+        "price_range": fields.get("price_range", "No especificado"),
+        "score": fields.get("NBH2", "N/A"),
+        "url": fields.get("url", "No especificado")
+    }
+
+# La llamada recibida tal como se devuelve en 'api_call' (método y URL completa con los parámetros)
+def llamada_recibida(request: Request) -> str:
+    return f"{request.method} {request.url}"
+
+# Parte común de los endpoints de búsqueda: busca los restaurantes y prepara las variables usadas, que van en
+# todas las respuestas. Devuelve (restaurantes, filter_formula, variables)
+async def ejecutar_busqueda(
+    city: str,
+    dia_semana: Optional[str] = None,
+    price_range: Optional[str] = None,
+    cocina: Optional[str] = None,
+    diet: Optional[str] = None,
+    dish: Optional[str] = None,
+    zona: Optional[str] = None,
+    coordenadas: Optional[str] = None
+) -> (list[dict], Optional[str], dict):
+    restaurantes, filter_formula = await obtener_restaurantes_por_ciudad(
+        city=city,
+        dia_semana=dia_semana,
+        price_range=price_range,
+        cocina=cocina,
+        diet=diet,
+        dish=dish,
+        zona=zona,
+        coordenadas=coordenadas,
+        sort_by_proximity=True
+    )
+
+    variables = {
+        "city": city,
+        "price_range": price_range,
+        "cuisine_type": cocina,
+        "diet": diet,
+        "dish": dish,
+        "zone": zona
+    }
+
+    return restaurantes, filter_formula, variables
+
+# Busca restaurantes y construye la respuesta de /api/getRestaurants (también la usa cada consulta del batch).
+# api_call es la llamada a /api/getRestaurants que se devuelve en la respuesta
+async def buscar_para_get_restaurantes(
+    api_call: str,
+    city: str,
+    coordenadas: Optional[str] = None,
+    price_range: Optional[str] = None,
+    cocina: Optional[str] = None,
+    diet: Optional[str] = None,
+    dish: Optional[str] = None,
+    zona: Optional[str] = None
+) -> dict:
+    restaurantes, filter_formula, variables = await ejecutar_busqueda(
+        city=city,
+        price_range=price_range,
+        cocina=cocina,
+        diet=diet,
+        dish=dish,
+        zona=zona,
+        coordenadas=coordenadas
+    )
+    variables["coordenadas"] = coordenadas
+
+    # Revisar si hay restaurantes
+    if not restaurantes:
+        return {
+            "mensaje": "No se encontraron restaurantes con los filtros aplicados.",
+            "variables": variables,
+            "api_call": api_call,
+            "filter_formula": filter_formula  # opcional, para debug
+        }
+
+    # Si sí hay restaurantes
+    return {
+        "restaurants": list(map(formatear_restaurante, restaurantes)),
+        "variables": variables,
+        "api_call": api_call,
+        "filter_formula": filter_formula
+    }
 
 @app.get("/api/getRestaurants")
 async def get_restaurantes(
     request: Request,
-    city: str = Query(..., description="Ciudad donde buscar restaurantes"),
+    city: str = Query(..., min_length=1, description="Ciudad donde buscar restaurantes"),
     coordenadas: Optional[str] = Query(None, description="Coordenadas en formato 'lat,lng'"),
     price_range: Optional[str] = Query(None, description="Rango de precios"),
     cocina: Optional[str] = Query(None, description="Tipo de cocina preferida"),
     diet: Optional[str] = Query(None, description="Restricciones dietéticas"),
     dish: Optional[str] = Query(None, description="Plato específico"),
     zona: Optional[str] = Query(None, description="Zona específica dentro de la ciudad")
-):
+) -> dict:
     try:
-        restaurantes, filter_formula = obtener_restaurantes_por_ciudad(
+        return await buscar_para_get_restaurantes(
+            llamada_recibida(request),
             city=city,
+            coordenadas=coordenadas,
             price_range=price_range,
             cocina=cocina,
             diet=diet,
             dish=dish,
-            zona=zona,
-            coordenadas=coordenadas,
-            sort_by_proximity=True
+            zona=zona
         )
-        
-        # Capturar la URL completa y los parámetros de la solicitud
-        full_url = str(request.url)
-        request_method = request.method
-        api_call = f"{request_method} {full_url}"
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error("Error al buscar restaurantes en /api/getRestaurants: %s", e)
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
 
-        # Revisar si hay restaurantes
-        if not restaurantes:
-            return {
-                "mensaje": "No se encontraron restaurantes con los filtros aplicados.",
-                "variables": {
-                    "city": city,
-                    "price_range": price_range,
-                    "cuisine_type": cocina,
-                    "diet": diet,
-                    "dish": dish,
-                    "zone": zona,
-                    "coordenadas": coordenadas
-                },
-                "api_call": api_call,
-                "filter_formula": filter_formula  # opcional, para debug
-            }
+# Una consulta del batch: los mismos filtros (y validaciones) que los parámetros de /api/getRestaurants
+class ConsultaRestaurantes(BaseModel):
+    city: str = Field(..., min_length=1, description="Ciudad donde buscar restaurantes")
+    coordenadas: Optional[str] = Field(None, description="Coordenadas en formato 'lat,lng'")
+    price_range: Optional[str] = Field(None, description="Rango de precios")
+    cocina: Optional[str] = Field(None, description="Tipo de cocina preferida")
+    diet: Optional[str] = Field(None, description="Restricciones dietéticas")
+    dish: Optional[str] = Field(None, description="Plato específico")
+    zona: Optional[str] = Field(None, description="Zona específica dentro de la ciudad")
 
-        # Si sí hay restaurantes
-        resultados = [
-            {
-                "cid": r["fields"].get("cid"),
-                "title": r["fields"].get("title", "Sin título"),
-                "description": r["fields"].get("bh_message", "Sin descripción"),
-                "price_range": r["fields"].get("price_range", "No especificado"),
-                "score": r["fields"].get("NBH2", "N/A"),
-                "url": r["fields"].get("url", "No especificado")
-            }
-            for r in restaurantes
-        ]
+# Límites del batch: consultas por petición y búsquedas en vuelo a la vez en el proceso, sumando todos los batch
+# que lleguen a la vez (para no saturar Airtable). El semáforo se crea al arrancar la app (lifespan)
+MAX_CONSULTAS_BATCH = 50
+MAX_BUSQUEDAS_SIMULTANEAS = 16
+semaforo_batch: Optional[asyncio.Semaphore] = None
 
-        return {
-            "restaurants": resultados,
-            "variables": {
-                "city": city,
-                "price_range": price_range,
-                "cuisine_type": cocina,
-                "diet": diet,
-                "dish": dish,
-                "zone": zona,
-                "coordenadas": coordenadas
-            },
-            "api_call": api_call,
-            "filter_formula": filter_formula
-        }
+# La llamada a GET /api/getRestaurants equivalente a una consulta del batch, para el 'api_call' de su respuesta
+def llamada_equivalente(request: Request, consulta: ConsultaRestaurantes) -> str:
+    url = request.url_for("get_restaurantes").include_query_params(**consulta.model_dump(exclude_none=True))
+    return f"GET {url}"
 
+# Varias búsquedas en una sola petición (pensado para n8n). Devuelve una respuesta por consulta, en el mismo
+# orden y con el mismo formato que /api/getRestaurants (con el api_call de la consulta GET equivalente);
+# si una consulta es inválida, su respuesta es el error
+@app.post("/api/getRestaurants/batch")
+async def get_restaurantes_batch(
+    request: Request,
+    consultas: list[ConsultaRestaurantes] = Body(..., min_length=1, max_length=MAX_CONSULTAS_BATCH)
+) -> list[dict]:
+    async def buscar(consulta: ConsultaRestaurantes) -> dict:
+        async with semaforo_batch:
+            try:
+                return await buscar_para_get_restaurantes(
+                    llamada_equivalente(request, consulta), **consulta.model_dump()
+                )
+            except HTTPException as e:
+                return {"status_code": e.status_code, "detail": e.detail}
+
+    try:
+        return await asyncio.gather(*map(buscar, consultas))
     except Exception as e:
-        logging.error(f"Error al buscar restaurantes en /api/getRestaurants: {e}")
+        logging.error("Error al buscar restaurantes en /api/getRestaurants/batch: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+# Campos que devuelve /procesar-variables de cada restaurante, con su valor por defecto si Airtable no lo trae
+obtener_bh_message = operator.methodcaller('get', 'bh_message', 'Sin descripción')
+obtener_url = operator.methodcaller('get', 'url', 'No especificado')
+
+# Lee el cuerpo JSON de una petición con orjson (request.json() de Starlette usa el módulo json estándar)
+async def leer_json(request: Request):
+    return orjson.loads(await request.body())
+
 @app.post("/procesar-variables")
-async def procesar_variables(request: Request):
+async def procesar_variables(request: Request) -> dict:
     try:
-        data = await request.json()
-        logging.info(f"Datos recibidos: {data}")
+        data = await leer_json(request)
+        logging.debug("Datos recibidos: %s", data)
         
         city = data.get('city')
         date = data.get('date')
@@ -108,10 +229,20 @@ async def procesar_variables(request: Request):
         zona = data.get('zona')
         coordenadas = data.get('coordenadas')
 
+        if not city or not city.strip():
+            raise HTTPException(status_code=400, detail="La variable 'city' es obligatoria.")
+
+        dia_semana = None
+        if date:
+            try:
+                dia_semana = dia_semana_desde_texto(date)
+            except (ValueError, TypeError):
+                raise HTTPException(status_code=400, detail="La fecha proporcionada no tiene el formato correcto (YYYY-MM-DD).")
+
         # Llamar a la función para obtener los restaurantes y la fórmula de filtro
-        logging.info(f"Coordenadas recibidas: {coordenadas}")
-        restaurantes, filter_formula = obtener_restaurantes_por_ciudad(
+        restaurantes, _, variables = await ejecutar_busqueda(
             city=city,
+            dia_semana=dia_semana,
             price_range=price_range,
             cocina=cocina,
             diet=diet,
@@ -120,43 +251,26 @@ async def procesar_variables(request: Request):
             coordenadas=coordenadas
         )
 
-        full_url = str(request.url)
-        request_method = request.method
-        api_call = f'{request_method} {full_url}'
-
         # Devolver los restaurantes, las variables y la llamada a la API
+        api_call = llamada_recibida(request)
         if restaurantes:
+            fields = [r['fields'] for r in restaurantes]
             return {
                 "restaurants": [
-                    {
-                        "bh_message": r['fields'].get('bh_message', 'Sin descripción'),
-                        "url": r['fields'].get('url', 'No especificado')
-                    }
-                    for r in restaurantes
+                    {"bh_message": bh_message, "url": url}
+                    for bh_message, url in zip(map(obtener_bh_message, fields), map(obtener_url, fields))
                 ],
-                "variables": {
-                    "city": city,
-                    "price_range": price_range,
-                    "cuisine_type": cocina,
-                    "diet": diet,
-                    "dish": dish,
-                    "zone": zona
-                },
+                "variables": variables,
                 "api_call": api_call
             }
         else:
             return {
                 "mensaje": "No se encontraron restaurantes con los filtros aplicados.",
-                "variables": {
-                    "city": city,
-                    "price_range": price_range,
-                    "cuisine_type": cocina,
-                    "diet": diet,
-                    "dish": dish,
-                    "zone": zona
-                },
+                "variables": variables,
                 "api_call": api_call
             }
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Error al procesar variables: {e}")
+        logging.error("Error al procesar variables: %s", e)
         raise HTTPException(status_code=500, detail="Error al procesar variables")
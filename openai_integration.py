@@ -1,54 +1,75 @@
+import json
 import openai
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Sesión compartida: reutiliza la conexión (y el handshake TLS) con la API entre llamadas
+session = requests.Session()
+session.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(total=2, backoff_factor=0.2)
+))
+
+# URL de tu API desplegada en Render
+API_URL = "https://your-api-onrender.com/api/getRestaurants"
 
 # Define la función que hará la llamada a tu API en Render
 def call_get_restaurantes(city, date, price_range=None, cocina=None):
-    # URL de tu API desplegada en Render
-    url = f"https://your-api-onrender.com/api/getRestaurants?city={city}&date={date}"
-    if price_range:
-        url += f"&price_range={price_range}"
-    if cocina:
-        url += f"&cocina={cocina}"
-    
-    response = requests.get(url)
+    # requests codifica los parámetros y omite los que son None
+    params = {
+        "city": city,
+        "date": date,
+        "price_range": price_range,
+        "cocina": cocina
+    }
+
+    response = session.get(API_URL, params=params)
     return response.json()
 
-# Simulación de una solicitud de usuario y procesamiento por OpenAI
-user_input = "Estoy buscando un restaurante en Madrid el viernes con un rango de precios de 30-40 y cocina Italiana."
-
-# Configura la llamada a OpenAI
-response = openai.ChatCompletion.create(
-    model="gpt-4",
-    messages=[
-        {"role": "system", "content": "Eres un asistente útil."},
-        {"role": "user", "content": user_input},
-    ],
-    functions=[
-        {
-            "name": "get_restaurantes",
-            "description": "Obtén los mejores restaurantes según las preferencias del usuario utilizando una API desplegada en Render que se conecta a Airtable.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "city": {"type": "string", "description": "La ciudad donde el usuario quiere encontrar restaurantes."},
-                    "date": {"type": "string", "description": "La fecha para la reserva del restaurante."},
-                    "price_range": {"type": "string", "description": "El rango de precios deseado."},
-                    "cocina": {"type": "string", "description": "El tipo de cocina preferido."}
-                },
-                "required": ["city", "date"]
+# Ejemplo de uso: solo se ejecuta al lanzar el script directamente, no al importarlo
+if __name__ == "__main__":
+    # Simulación de una solicitud de usuario y procesamiento por OpenAI
+    user_input = "Estoy buscando un restaurante en Madrid el viernes con un rango de precios de 30-40 y cocina Italiana."
+
+    # Configura la llamada a OpenAI
+    client = openai.OpenAI()
+    response = client.chat.completions.create(
+        model="gpt-4",
+        messages=[
+            {"role": "system", "content": "Eres un asistente útil."},
+            {"role": "user", "content": user_input},
+        ],
+        tools=[
+            {
+                "type": "function",
+                "function": {
+                    "name": "get_restaurantes",
+                    "description": "Obtén los mejores restaurantes según las preferencias del usuario utilizando una API desplegada en Render que se conecta a Airtable.",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "city": {"type": "string", "description": "La ciudad donde el usuario quiere encontrar restaurantes."},
+                            "date": {"type": "string", "description": "La fecha para la reserva del restaurante."},
+                            "price_range": {"type": "string", "description": "El rango de precios deseado."},
+                            "cocina": {"type": "string", "description": "El tipo de cocina preferido."}
+                        },
+                        "required": ["city", "date"]
+                    }
+                }
             }
-        }
-    ],
-    function_call={"name": "get_restaurantes"}
-)
-
-# Extrae los argumentos de la función
-function_args = response["choices"][0]["message"]["function_call"]["arguments"]
-city = function_args.get("city")
-date = function_args.get("date")
-price_range = function_args.get("price_range")
-cocina = function_args.get("cocina")
-
-# Llama a la API de Render
-restaurant_data = call_get_restaurantes(city, date, price_range, cocina)
-print(restaurant_data)
+        ],
+        tool_choice={"type": "function", "function": {"name": "get_restaurantes"}}
+    )
+
+    # Extrae los argumentos de la función (la API los devuelve como texto JSON)
+    function_args = json.loads(response.choices[0].message.tool_calls[0].function.arguments)
+    city = function_args.get("city")
+    date = function_args.get("date")
+    price_range = function_args.get("price_range")
+    cocina = function_args.get("cocina")
+
+    # Llama a la API de Render
+    restaurant_data = call_get_restaurantes(city, date, price_range, cocina)
+    print(restaurant_data)
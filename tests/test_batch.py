@@ -0,0 +1,92 @@
+# Tests de POST /api/getRestaurants/batch. La búsqueda se sustituye por una falsa, así no se llama a Airtable ni a Google
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+
+
+# Búsqueda falsa: devuelve un restaurante con el nombre de la ciudad. Las primeras consultas tardan más,
+# para que terminen en orden inverso al de llegada. La ciudad 'error' falla como unas coordenadas inválidas
+async def busqueda_falsa(city, coordenadas=None, sort_by_proximity=True, **filtros):
+    if city == "error":
+        raise HTTPException(status_code=400, detail="Coordenadas inválidas. Deben ser [lat, lng] en texto.")
+    await asyncio.sleep(0.05 / (1 + len(city)))
+    return [{"id": city, "fields": {"title": city}}], f"formula-{city}"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "obtener_restaurantes_por_ciudad", busqueda_falsa)
+    # Con 'with' se ejecuta el lifespan, que crea el semáforo del batch
+    with TestClient(main.app) as c:
+        yield c
+
+
+def test_batch_mantiene_el_orden_de_las_consultas(client):
+    ciudades = ["a", "bb", "ccc", "dddd", "eeeee"]
+    r = client.post("/api/getRestaurants/batch", json=[{"city": c} for c in ciudades])
+
+    assert r.status_code == 200
+    assert [slot["restaurants"][0]["title"] for slot in r.json()] == ciudades
+
+
+def test_batch_devuelve_el_error_en_su_posicion(client):
+    consultas = [{"city": "Madrid"}, {"city": "error"}, {"city": "Sevilla"}]
+    r = client.post("/api/getRestaurants/batch", json=consultas)
+
+    assert r.status_code == 200
+    madrid, error, sevilla = r.json()
+    assert madrid["restaurants"][0]["title"] == "Madrid"
+    assert error == {"status_code": 400, "detail": "Coordenadas inválidas. Deben ser [lat, lng] en texto."}
+    assert sevilla["restaurants"][0]["title"] == "Sevilla"
+
+
+def test_batch_cada_respuesta_es_la_del_get_equivalente(client):
+    consulta = {"city": "A Coruña", "coordenadas": "43.3,-8.4", "cocina": "l'italiana"}
+    slot = client.post("/api/getRestaurants/batch", json=[consulta]).json()[0]
+
+    assert slot["api_call"].startswith("GET http://testserver/api/getRestaurants?")
+    assert slot == client.get("/api/getRestaurants", params=consulta).json()
+
+
+@pytest.mark.parametrize("n, esperado", [(0, 422), (1, 200), (main.MAX_CONSULTAS_BATCH, 200), (main.MAX_CONSULTAS_BATCH + 1, 422)])
+def test_batch_limites_de_tamano(client, n, esperado):
+    r = client.post("/api/getRestaurants/batch", json=[{"city": "Madrid"}] * n)
+
+    assert r.status_code == esperado
+
+
+def test_batch_coordenadas_invalidas_sin_sustituir_la_busqueda():
+    # Con la búsqueda real: las coordenadas se validan antes de llamar a Google o Airtable
+    r = TestClient(main.app).post("/api/getRestaurants/batch", json=[{"city": "Madrid", "coordenadas": "abc"}])
+
+    assert r.status_code == 200
+    assert r.json() == [{"status_code": 400, "detail": "Coordenadas inválidas. Deben ser [lat, lng] en texto."}]
+
+
+# El límite de búsquedas simultáneas es del proceso: varios batch a la vez no lo multiplican
+def test_batch_simultaneos_comparten_el_limite_de_busquedas(client, monkeypatch):
+    en_vuelo = 0
+    maximo = 0
+
+    async def busqueda_lenta(city, **filtros):
+        nonlocal en_vuelo, maximo
+        en_vuelo += 1
+        maximo = max(maximo, en_vuelo)
+        await asyncio.sleep(0.05)
+        en_vuelo -= 1
+        return [], None
+
+    monkeypatch.setattr(main, "obtener_restaurantes_por_ciudad", busqueda_lenta)
+    consultas = [{"city": f"ciudad{i}"} for i in range(main.MAX_BUSQUEDAS_SIMULTANEAS)]
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        respuestas = list(pool.map(
+            lambda _: client.post("/api/getRestaurants/batch", json=consultas), range(3)
+        ))
+
+    assert all(r.status_code == 200 for r in respuestas)
+    assert maximo == main.MAX_BUSQUEDAS_SIMULTANEAS
@@ -0,0 +1,140 @@
+# Tests de la caché de Airtable y Google Maps (cache_airtable_request). Airtable y Google se sustituyen por
+# transportes falsos de httpx que cuentan las llamadas; Redis no se usa
+import asyncio
+
+import httpx
+import pytest
+
+import bistrohunter
+
+
+# Airtable falso: cada llamada devuelve la siguiente respuesta de la lista (la última se repite).
+# Un número es una respuesta con ese número de registros; None, un error 500
+class AirtableFalso:
+    def __init__(self, *respuestas):
+        self.respuestas = list(respuestas)
+        self.llamadas = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        respuesta = self.respuestas[min(self.llamadas, len(self.respuestas) - 1)]
+        self.llamadas += 1
+        if respuesta is None:
+            return httpx.Response(500)
+        return httpx.Response(200, json={"records": [{"id": str(i)} for i in range(respuesta)]})
+
+
+# Google Maps falso: responde siempre con el mismo status de geocodificación
+class GoogleFalso:
+    def __init__(self, status: str):
+        self.status = status
+        self.llamadas = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.llamadas += 1
+        return httpx.Response(200, json={"status": self.status, "results": []})
+
+
+def registros(resultado):
+    return len(resultado["records"])
+
+
+@pytest.fixture(autouse=True)
+def cache_limpia(monkeypatch):
+    monkeypatch.setattr(bistrohunter, "redis_client", None)
+    cachés = (bistrohunter.restaurantes_cache, bistrohunter.coordenadas_cache, bistrohunter.busquedas_cache)
+    for cache in cachés:
+        cache.clear()
+    bistrohunter.peticiones_airtable.clear()
+    yield
+    for cache in cachés:
+        cache.clear()
+
+
+# Ejecuta la corrutina con clientes de Airtable y Google que responden con 'airtable' y 'google'
+def ejecutar(airtable: AirtableFalso, corrutina, google: GoogleFalso = None):
+    async def con_cliente():
+        bistrohunter.airtable_lock = asyncio.Lock()
+        bistrohunter.airtable_client = httpx.AsyncClient(transport=httpx.MockTransport(airtable))
+        bistrohunter.http_client = httpx.AsyncClient(transport=httpx.MockTransport(google or GoogleFalso("OK")))
+        try:
+            return await corrutina()
+        finally:
+            await bistrohunter.cerrar_clientes()
+    return asyncio.run(con_cliente())
+
+
+async def pedir():
+    return await bistrohunter.airtable_request(bistrohunter.URL_RESTAURANTES, {"filterByFormula": "x"})
+
+
+# Hace que todas las entradas de la caché parezcan guardadas hace más de ttl_fresco
+def caducar_entradas():
+    cache = bistrohunter.restaurantes_cache
+    for clave, (resultado, guardado_en) in list(cache.items()):
+        cache[clave] = (resultado, guardado_en - bistrohunter.RESTAURANTES_TTL_FRESCO - 1)
+
+
+async def esperar_refrescos():
+    await asyncio.gather(*bistrohunter.tareas_en_segundo_plano)
+
+
+def test_dato_caducado_se_sirve_y_se_refresca_en_segundo_plano():
+    airtable = AirtableFalso(3, 4)
+
+    async def escenario():
+        assert registros(await pedir()) == 3
+        caducar_entradas()
+        # El dato caducado se devuelve sin esperar a Airtable
+        assert registros(await pedir()) == 3
+        await esperar_refrescos()
+        assert registros(await pedir()) == 4
+
+    ejecutar(airtable, escenario)
+    assert airtable.llamadas == 2
+
+
+@pytest.mark.parametrize("respuesta_refresco", [2, None], ids=["menos_registros", "error"])
+def test_refresco_descartado_no_se_repite_en_cada_acierto(respuesta_refresco):
+    airtable = AirtableFalso(3, respuesta_refresco)
+
+    async def escenario():
+        await pedir()
+        caducar_entradas()
+        assert registros(await pedir()) == 3
+        await esperar_refrescos()
+        # Se sigue sirviendo la lista buena, y sin volver a preguntar a Airtable hasta que caduque de nuevo
+        for _ in range(4):
+            assert registros(await pedir()) == 3
+        await esperar_refrescos()
+
+    ejecutar(airtable, escenario)
+    assert airtable.llamadas == 2
+
+
+def test_respuesta_fallida_no_se_cachea():
+    airtable = AirtableFalso(None, 3)
+
+    async def escenario():
+        assert await pedir() is None
+        assert registros(await pedir()) == 3
+        assert registros(await pedir()) == 3
+
+    ejecutar(airtable, escenario)
+    assert airtable.llamadas == 2
+
+
+# Una zona que Google no conoce es una respuesta válida: la búsqueda se cachea y no se vuelve a pagar la geocodificación.
+# Si la llamada a Google falla, en cambio, no se cachea nada
+@pytest.mark.parametrize("status, llamadas_google", [("ZERO_RESULTS", 1), ("OVER_QUERY_LIMIT", 3)])
+def test_zona_no_encontrada_se_cachea_y_el_fallo_no(status, llamadas_google):
+    airtable = AirtableFalso(3)
+    google = GoogleFalso(status)
+
+    async def escenario():
+        for _ in range(3):
+            restaurantes, _ = await bistrohunter.obtener_restaurantes_por_ciudad("Madrid", zona="Zona inventada")
+            assert restaurantes == []
+
+    ejecutar(airtable, escenario, google)
+    assert google.llamadas == llamadas_google
+    assert airtable.llamadas == 0
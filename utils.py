@@ -0,0 +1,78 @@
+# Funciones auxiliares (fechas y geografía) compartidas por bistrohunter.py y main.py
+from datetime import date, datetime
+from functools import lru_cache
+from math import radians, degrees, cos, sin, asin, sqrt, pi
+
+RADIO_TIERRA_KM = 6371.0
+
+# Días de la semana en el orden de datetime.weekday() (0 = lunes)
+DAYS_ES = ("lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo")
+
+# Día de la semana ('lunes', ...) de una fecha. Sin caché propia: se llama desde dia_semana_desde_texto, que ya
+# está cacheada por texto
+def obtener_dia_semana(fecha: date) -> str:
+    return DAYS_ES[fecha.weekday()]
+
+# Convierte un texto YYYY-MM-DD en date. Acepta lo mismo que datetime.strptime(texto, "%Y-%m-%d"), pero el
+# caso habitual (con ceros) se trocea a mano sin pasar por strptime.
+# Lanza ValueError si el texto no tiene ese formato o la fecha no existe
+def parsear_fecha(texto: str) -> date:
+    anio, mes, dia = texto[0:4], texto[5:7], texto[8:10]
+    if len(texto) == 10 and texto[4] == "-" and texto[7] == "-" and (anio + mes + dia).isdigit():
+        return date(int(anio), int(mes), int(dia))
+    # Mes o día sin cero delante ('2024-5-3') y textos inválidos
+    return datetime.strptime(texto, "%Y-%m-%d").date()
+
+# Día de la semana ('lunes', ...) de un texto YYYY-MM-DD. Cacheada por texto, así las fechas repetidas
+# se resuelven sin parsear. Lanza ValueError igual que parsear_fecha
+@lru_cache(maxsize=4096)
+def dia_semana_desde_texto(texto: str) -> str:
+    return obtener_dia_semana(parsear_fecha(texto))
+
+# Distancias haversianas (km) desde un centro a una lista de puntos (lat, lng), con el mismo radio terrestre que
+# la bounding box. Lo que depende solo del centro (radianes y coseno de su latitud) se calcula una única vez
+def distancias_desde(lat_centro, lon_centro, puntos):
+    lat0 = radians(lat_centro)
+    lon0 = radians(lon_centro)
+    cos_lat0 = cos(lat0)
+    distancias = []
+    for lat, lng in puntos:
+        lat1 = radians(lat)
+        a = sin((lat1 - lat0) / 2) ** 2 + cos_lat0 * cos(lat1) * sin((radians(lng) - lon0) / 2) ** 2
+        distancias.append(RADIO_TIERRA_KM * 2 * asin(sqrt(a)))
+    return distancias
+
+
+def calcular_bounding_box(lat, lon, radio_km=1):
+    # Redondeamos a 4 decimales (~11 m) para que coordenadas casi iguales compartan la entrada de caché
+    return _calcular_bounding_box(round(lat, 4), round(lon, 4), radio_km)
+
+# El resultado se comparte entre llamadas: no modificar el dict devuelto
+@lru_cache(maxsize=1024)
+def _calcular_bounding_box(lat, lon, radio_km):
+    # Caja mínima que contiene el círculo de radio radio_km sobre la esfera
+    # (J. Matuschek, "Finding Points Within a Distance of a Latitude/Longitude Using Bounding Coordinates")
+    distancia_angular = radio_km / RADIO_TIERRA_KM
+    lat_centro = radians(lat)
+    lat_min = lat_centro - distancia_angular
+    lat_max = lat_centro + distancia_angular
+
+    if lat_min > -pi / 2 and lat_max < pi / 2:
+        # Por la relación de Clairaut, el círculo alcanza su longitud extrema en una latitud más cercana al polo
+        # que la del centro; esta es la mitad de anchura exacta, sin pasar por coordenadas x/y/z
+        delta_lon = asin(sin(distancia_angular) / cos(lat_centro))
+        lon_min = max(radians(lon) - delta_lon, -pi)
+        lon_max = min(radians(lon) + delta_lon, pi)
+    else:
+        # El círculo contiene un polo: vale cualquier longitud
+        lat_min = max(lat_min, -pi / 2)
+        lat_max = min(lat_max, pi / 2)
+        lon_min = -pi
+        lon_max = pi
+
+    return {
+        "lat_min": degrees(lat_min),
+        "lat_max": degrees(lat_max),
+        "lon_min": degrees(lon_min),
+        "lon_max": degrees(lon_max)
+    }